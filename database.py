@@ -5,7 +5,7 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -21,12 +21,32 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# The pool is per process and `python main.py` starts WEB_CONCURRENCY workers
+# (default: one per CPU), so split a cluster-wide connection budget between
+# them. MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE override the per-worker values.
+_workers = max(1, int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2)))
+max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", max(10, 100 // _workers)))
+min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", max(1, 8 // _workers)))
+
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Module-level singleton so every request shares one connection pool.
+    # minPoolSize keeps warm sockets so bursts don't wait on TCP/TLS handshakes,
+    # and wire compression shrinks the HTML-heavy project documents.
+    _client = AsyncMongoClient(
+        database_url,
+        maxPoolSize=max_pool_size,
+        minPoolSize=min_pool_size,
+        # Long enough to ride out a replica-set election (~10 s); past that the
+        # API answers 503 (see main.py) instead of hanging
+        waitQueueTimeoutMS=10000,
+        serverSelectionTimeoutMS=15000,
+        compressors="zstd,zlib",
+        readPreference="primaryPreferred",
+    )
     db = _client[database_name]
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +60,18 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None, sort: list = None):
+    """Get documents from collection, optionally projecting fields server-side"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list()
@@ -1,181 +1,301 @@
 import os
-from fastapi import FastAPI, HTTPException, Header
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+import asyncio
+import logging
+import re
+import string
+import weakref
+from contextlib import asynccontextmanager
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Header, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, NamedTuple, Optional, Dict, Any
 from datetime import datetime, timezone
+from functools import lru_cache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from database import db, create_document, get_documents
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import ServerSelectionTimeoutError, WaitQueueTimeoutError
+from cachetools import TTLCache
+import orjson
 
-app = FastAPI(title="CriM🔥Son API", version="0.1.0")
+logger = logging.getLogger(__name__)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# Owner of projects created without an X-User-Id header
+GUEST = "guest"
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+
+def dumps_json(content: Any) -> bytes:
+    return orjson.dumps(
+        content,
+        default=_orjson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also knows how to serialize BSON ObjectIds."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup work is defined in the STARTUP section below
+    warm_templates()
+    # Index builds run in the background so an unreachable database
+    # doesn't hold up readiness for the server selection timeout
+    index_task = asyncio.create_task(ensure_indexes())
+    try:
+        yield
+    finally:
+        index_task.cancel()
+
+
+app = FastAPI(
+    title="CriM🔥Son API",
+    version="0.1.0",
+    default_response_class=MongoJSONResponse,
+    lifespan=lifespan,
+)
+
+_PREFLIGHT_HEADERS = [
+    (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+    (b"access-control-max-age", b"600"),
+]
+
+
+def _cors_headers(origin: bytes):
+    # Browsers reject "*" on credentialed requests, so echo the caller's origin
+    return [
+        (b"access-control-allow-origin", origin),
+        (b"access-control-allow-credentials", b"true"),
+        (b"vary", b"Origin"),
+    ]
+
+
+class PureCORS:
+    """Allow-all CORS as plain ASGI: headers go straight into the send message."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        origin = request_headers.get(b"origin")
+        if origin is None:
+            # Not a cross-origin request
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and b"access-control-request-method" in request_headers:
+            # Answer preflights here so they never reach the router
+            headers = _cors_headers(origin) + _PREFLIGHT_HEADERS
+            requested = request_headers.get(b"access-control-request-headers")
+            if requested:
+                headers.append((b"access-control-allow-headers", requested))
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cors_headers = _cors_headers(origin)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).extend(cors_headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+@app.exception_handler(ServerSelectionTimeoutError)
+@app.exception_handler(WaitQueueTimeoutError)
+async def database_unavailable(request, exc):
+    # Pool saturation or no reachable primary: tell clients to retry
+    logger.warning("Database unavailable: %s", exc)
+    return MongoJSONResponse(
+        {"detail": "Database temporarily unavailable"},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+# Project payloads carry highly repetitive HTML; tiny responses skip compression
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+app.add_middleware(PureCORS)
+
+
+REQUEST_MODEL_CONFIG = ConfigDict(
+    extra="forbid",
+    str_strip_whitespace=True,
+    validate_assignment=False,
+    frozen=True,
 )
 
 
+# Prompts are keys of the rendered-site LRU caches, so bound their size
+MAX_PROMPT_LENGTH = 2000
+MAX_MESSAGE_LENGTH = 1000
+
+
 class ProjectCreateRequest(BaseModel):
-    prompt: str
+    model_config = REQUEST_MODEL_CONFIG
+
+    prompt: str = Field(..., max_length=MAX_PROMPT_LENGTH)
     name: Optional[str] = None
 
 
 class ChatMessageRequest(BaseModel):
-    message: str
+    model_config = REQUEST_MODEL_CONFIG
+
+    message: str = Field(..., max_length=MAX_MESSAGE_LENGTH)
 
 
 class CodeUpdateRequest(BaseModel):
+    # User-edited HTML is stored verbatim, whitespace included
+    model_config = {**REQUEST_MODEL_CONFIG, "str_strip_whitespace": False}
+
     html: str
 
 
 class DeployResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     url: str
     status: str
 
 
-def oid_str(oid: ObjectId) -> str:
-    return str(oid)
+# Keywords are whole whitespace tokens: surrounding punctuation is stripped and
+# inner apostrophes/hyphens are allowed, but every other character must be alphabetic
+_KEYWORD_STRIP = string.punctuation + "“”‘’«»…"
+_KEYWORD_JOINERS = str.maketrans("", "", "'’-")
 
 
-def seo_from_prompt(prompt: str) -> Dict[str, str]:
-    title = prompt.strip().capitalize()[:60]
-    description = f"Auto-generated website: {prompt.strip()}"
-    keywords = ", ".join([w for w in prompt.lower().split() if w.isalpha()][:8])
-    return {"title": title or "CriM🔥Son Site", "description": description, "keywords": keywords}
+class SeoMeta(NamedTuple):
+    title: str
+    description: str
+    keywords: str
 
 
-def generate_site_html(prompt: str, accent="#DC143C") -> str:
-    seo = seo_from_prompt(prompt)
+# Cached results are shared between callers, hence the immutable SeoMeta
+@lru_cache(maxsize=1024)
+def seo_from_prompt(prompt: str) -> SeoMeta:
+    stripped = prompt.strip()
+    title = stripped.capitalize()[:60]
+    description = f"Auto-generated website: {stripped}"
+    words = (token.strip(_KEYWORD_STRIP) for token in stripped.lower().split())
+    keywords = ", ".join([w for w in words if w.translate(_KEYWORD_JOINERS).isalpha()][:8])
+    return SeoMeta(title=title or "CriM🔥Son Site", description=description, keywords=keywords)
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Compiled bytecode is persisted (JINJA_CACHE_DIR or the system temp dir),
+# so restarts and forked workers skip parsing the template again
+_jinja_env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    bytecode_cache=FileSystemBytecodeCache(os.getenv("JINJA_CACHE_DIR")),
+    # The prompt is user input: escape it in <title>, <meta content> and <h1>
+    autoescape=True,
+    auto_reload=False,
+)
+SITE_TEMPLATE_NAME = "site.html.j2"
+
+
+# The year is part of the key so cached pages roll over at New Year
+@lru_cache(maxsize=1024)
+def _render_site_html(prompt: str, accent: str, year: int) -> str:
     # Tailwind CDN for instant styling, Inter font, Lucide icons optional
-    # Spline hero section per system instructions
-    spline = "https://prod.spline.design/4cHQr84zOGAHOehh/scene.splinecode"
-    return f"""
-<!doctype html>
-<html lang=\"en\">
-  <head>
-    <meta charset=\"UTF-8\" />
-    <meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\" />
-    <title>{seo['title']}</title>
-    <meta name=\"description\" content=\"{seo['description']}\" />
-    <meta name=\"keywords\" content=\"{seo['keywords']}\" />
-    <link rel=\"preconnect\" href=\"https://fonts.googleapis.com\" />
-    <link rel=\"preconnect\" href=\"https://fonts.gstatic.com\" crossorigin />
-    <link href=\"https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;800&display=swap\" rel=\"stylesheet\" />
-    <script src=\"https://cdn.tailwindcss.com\"></script>
-    <style>
-      :root {{ --accent: {accent}; }}
-      html, body {{ height: 100%; }}
-      body {{ font-family: 'Inter', system-ui, -apple-system, Segoe UI, Roboto, sans-serif; }}
-      .crimson-gradient {{ background: radial-gradient(1200px 600px at 50% -20%, rgba(220,20,60,0.25), transparent),
-                           radial-gradient(800px 400px at 120% 20%, rgba(99,102,241,0.15), transparent),
-                           #0b0b10; }}
-      .glass {{ backdrop-filter: blur(12px); background: rgba(255,255,255,0.06); border: 1px solid rgba(255,255,255,0.08); }}
-      .btn {{ background: var(--accent); color: white; box-shadow: 0 10px 30px rgba(220,20,60,0.35); }}
-      .btn:hover {{ filter: brightness(1.05); transform: translateY(-1px); }}
-    </style>
-  </head>
-  <body class=\"min-h-full crimson-gradient text-white\">
-    <header class=\"sticky top-0 z-50 border-b border-white/10 bg-black/30 backdrop-blur\">
-      <div class=\"max-w-7xl mx-auto px-6 py-4 flex items-center justify-between\">
-        <a href=\"#\" class=\"font-extrabold tracking-tight text-xl\">CriM🔥Son</a>
-        <nav class=\"hidden md:flex gap-8 text-white/80\">
-          <a href=\"#features\" class=\"hover:text-white transition\">Features</a>
-          <a href=\"#templates\" class=\"hover:text-white transition\">Templates</a>
-          <a href=\"#contact\" class=\"hover:text-white transition\">Contact</a>
-        </nav>
-        <a href=\"#cta\" class=\"btn px-4 py-2 rounded-lg font-semibold\">Get Started</a>
-      </div>
-    </header>
-
-    <section class=\"relative\" aria-label=\"Hero\">
-      <div class=\"absolute inset-0 opacity-80\" style=\"pointer-events:none\">
-        <iframe src=\"{spline}\" title=\"AI Aura\" style=\"width:100%;height:100%;border:0;\"></iframe>
-      </div>
-      <div class=\"relative z-10 max-w-5xl mx-auto px-6 pt-28 pb-24 text-center\">
-        <h1 class=\"text-4xl md:text-6xl font-extrabold leading-tight\">{prompt}</h1>
-        <p class=\"mt-6 text-white/80 text-lg md:text-xl\">Production-ready site generated instantly. Clean, accessible, responsive, and fast.</p>
-        <div class=\"mt-10 flex items-center justify-center gap-4\" id=\"cta\">
-          <a href=\"#contact\" class=\"btn px-6 py-3 rounded-xl font-semibold\">Start Now</a>
-          <a href=\"#features\" class=\"px-6 py-3 rounded-xl font-semibold glass\">Explore Features</a>
-        </div>
-      </div>
-    </section>
-
-    <main class=\"relative z-10\">
-      <section id=\"features\" class=\"max-w-6xl mx-auto px-6 py-20 grid md:grid-cols-3 gap-6\">
-        <div class=\"glass rounded-2xl p-6\">
-          <h3 class=\"text-xl font-bold\">Instant Preview</h3>
-          <p class=\"text-white/80 mt-2\">Your site renders as you describe it. No waiting, no compiling.</p>
-        </div>
-        <div class=\"glass rounded-2xl p-6\">
-          <h3 class=\"text-xl font-bold\">Clean Code</h3>
-          <p class=\"text-white/80 mt-2\">Accessible, semantic HTML with responsive layouts out of the box.</p>
-        </div>
-        <div class=\"glass rounded-2xl p-6\">
-          <h3 class=\"text-xl font-bold\">SEO Ready</h3>
-          <p class=\"text-white/80 mt-2\">Meta tags, performance hints, and fast loading by default.</p>
-        </div>
-      </section>
-
-      <section id=\"templates\" class=\"max-w-6xl mx-auto px-6 pb-24\">
-        <h2 class=\"text-2xl font-bold mb-6\">Featured Sections</h2>
-        <div class=\"grid md:grid-cols-3 gap-6\">
-          <article class=\"glass rounded-xl overflow-hidden\">
-            <img src=\"https://picsum.photos/seed/hero/800/500\" alt=\"Placeholder image\" class=\"w-full h-40 object-cover\" />
-            <div class=\"p-5\">
-              <h3 class=\"font-semibold\">Hero + CTA</h3>
-              <p class=\"text-white/80 text-sm mt-1\">Crisp hero section with strong call-to-action.</p>
-            </div>
-          </article>
-          <article class=\"glass rounded-xl overflow-hidden\">
-            <img src=\"https://picsum.photos/seed/feature/800/500\" alt=\"Placeholder image\" class=\"w-full h-40 object-cover\" />
-            <div class=\"p-5\">
-              <h3 class=\"font-semibold\">Feature Grid</h3>
-              <p class=\"text-white/80 text-sm mt-1\">Explain value with icons and concise text.</p>
-            </div>
-          </article>
-          <article class=\"glass rounded-xl overflow-hidden\">
-            <img src=\"https://picsum.photos/seed/contact/800/500\" alt=\"Placeholder image\" class=\"w-full h-40 object-cover\" />
-            <div class=\"p-5\">
-              <h3 class=\"font-semibold\">Contact Form</h3>
-              <p class=\"text-white/80 text-sm mt-1\">Accessible form with client-side validation.</p>
-            </div>
-          </article>
-        </div>
-      </section>
-
-      <section id=\"contact\" class=\"max-w-2xl mx-auto px-6 pb-24\">
-        <div class=\"glass rounded-2xl p-8\">
-          <h2 class=\"text-2xl font-bold\">Get in touch</h2>
-          <form class=\"mt-6 grid gap-4\" onsubmit=\"event.preventDefault(); alert('Submitted!')\">
-            <div>
-              <label class=\"block text-sm text-white/70\">Name</label>
-              <input class=\"w-full mt-1 p-3 rounded-lg bg-white/10 border border-white/10 outline-none focus:border-white/30\" required />
-            </div>
-            <div>
-              <label class=\"block text-sm text-white/70\">Email</label>
-              <input type=\"email\" class=\"w-full mt-1 p-3 rounded-lg bg-white/10 border border-white/10 outline-none focus:border-white/30\" required />
-            </div>
-            <div>
-              <label class=\"block text-sm text-white/70\">Message</label>
-              <textarea rows=\"4\" class=\"w-full mt-1 p-3 rounded-lg bg-white/10 border border-white/10 outline-none focus:border-white/30\" required></textarea>
-            </div>
-            <button class=\"btn px-5 py-3 rounded-xl font-semibold\">Send</button>
-          </form>
-        </div>
-      </section>
-    </main>
-
-    <footer class=\"border-t border-white/10 py-10 text-center text-white/60\">
-      <p>© {datetime.now().year} CriM🔥Son — Generated by natural language</p>
-    </footer>
-  </body>
-</html>
+    # Spline hero section per system instructions (scene URL is in the template)
+    # Everything outside these four values is emitted as precompiled constants
+    return _jinja_env.get_template(SITE_TEMPLATE_NAME).render(
+        prompt=prompt,
+        seo=seo_from_prompt(prompt),
+        accent=accent,
+        year=year,
+    )
+
+
+def generate_site_html(prompt: str, accent="#DC143C") -> str:
+    return _render_site_html(prompt, accent, datetime.now().year)
+
+
+# Chat intents in priority order; the first pattern found in the message wins
+CHAT_INTENTS = [
+    ("scifi", re.compile(r"sci[- ]fi")),
+    ("dark", re.compile(r"make it dark|dark mode")),
+    ("pricing", re.compile(r"pricing")),
+    ("accent", re.compile(r"change accent|crimson")),
+]
+
+PRICING_SECTION = """
+<section id=\"pricing\" class=\"max-w-6xl mx-auto px-6 pb-24\">
+  <h2 class=\"text-2xl font-bold mb-6\">Pricing</h2>
+  <div class=\"grid md:grid-cols-3 gap-6\">
+    <div class=\"glass rounded-2xl p-6\"><h3 class=\"font-semibold\">Starter</h3><p class=\"text-4xl font-extrabold mt-2\">$0</p><p class=\"text-white/70 mt-2\">For experiments</p></div>
+    <div class=\"glass rounded-2xl p-6 border border-white/20\"><h3 class=\"font-semibold\">Pro</h3><p class=\"text-4xl font-extrabold mt-2\">$19</p><p class=\"text-white/70 mt-2\">For builders</p></div>
+    <div class=\"glass rounded-2xl p-6\"><h3 class=\"font-semibold\">Scale</h3><p class=\"text-4xl font-extrabold mt-2\">$99</p><p class=\"text-white/70 mt-2\">For teams</p></div>
+  </div>
+</section>
 """
 
+# Find/replace tables for the edits Mongo can apply to the stored html itself
+CHAT_EDITS = {
+    "scifi": {
+        "#0b0b10": "#05060a",
+        "rgba(99,102,241,0.15)": "rgba(56,189,248,0.18)",
+        "Production-ready": "Sci‑fi neon aesthetic with holographic accents",
+    },
+    "dark": {"#0b0b10": "#0a0a0a"},
+    "pricing": {"</main>": PRICING_SECTION + "\n    </main>"},
+    "accent": {"--accent: #DC143C": "--accent: #b80f2a"},
+}
+
+CHAT_EDIT_NOTES = {
+    "scifi": "Applied sci-fi theme",
+    "dark": "Darkened base colors",
+    "pricing": "Added pricing section",
+    "accent": "Adjusted accent color",
+}
+
+
+def match_chat_intent(msg: str) -> Optional[str]:
+    for intent, pattern in CHAT_INTENTS:
+        if pattern.search(msg):
+            return intent
+    return None
+
+
+def chat_edit_pipeline(table: Dict[str, str], now: datetime, history: List[dict], note: str) -> List[dict]:
+    """Update pipeline that edits html in place and appends history/versions."""
+    html = {"$ifNull": ["$html", ""]}
+    for find, replacement in table.items():
+        html = {"$replaceAll": {"input": html, "find": {"$literal": find}, "replacement": {"$literal": replacement}}}
+    return [
+        {"$set": {"html": html, "updated_at": now}},
+        # Second stage so the version snapshot sees the edited html
+        {"$set": {
+            "history": {"$concatArrays": [{"$ifNull": ["$history", []]}, {"$literal": history}]},
+            "versions": {"$concatArrays": [
+                {"$ifNull": ["$versions", []]},
+                [{"timestamp": now, "html": "$html", "note": {"$literal": note}}],
+            ]},
+        }},
+    ]
+
 
 @app.get("/")
 def read_root():
@@ -183,7 +303,7 @@ def read_root():
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -196,7 +316,7 @@ def test_database():
         if db is not None:
             response["database"] = "✅ Available"
             try:
-                response["collections"] = db.list_collection_names()[:10]
+                response["collections"] = (await db.list_collection_names())[:10]
                 response["connection_status"] = "Connected"
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -213,145 +333,240 @@ def test_database():
 def auth_guest():
     # In a real app, integrate Google/Apple. Here we return a pseudo user id
     uid = f"guest_{int(datetime.now(tz=timezone.utc).timestamp())}"
-    return {"user_id": uid, "name": "Guest"}
+    return MongoJSONResponse({"user_id": uid, "name": "Guest"})
+
+
+# --------------------------------- STARTUP ---------------------------------
+def warm_templates():
+    # Loaded here rather than at import so cold-start imports stay cheap
+    _jinja_env.get_template(SITE_TEMPLATE_NAME)
+
+
+async def ensure_indexes():
+    if db is None:
+        return
+    try:
+        # Every project route filters on user_id; the list view also orders by recency
+        await db.projects.create_index([("user_id", 1), ("_id", 1)])
+        await db.projects.create_index([("user_id", 1), ("updated_at", -1)])
+    except Exception as e:
+        logger.warning("Could not create project indexes: %s", e)
 
 
 # ------------------------------ PROJECTS CRUD ------------------------------
 @app.post("/projects")
-def create_project(req: ProjectCreateRequest, x_user_id: Optional[str] = Header(default=None)):
+async def create_project(req: ProjectCreateRequest, x_user_id: Optional[str] = Header(default=None)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
     html = generate_site_html(req.prompt)
+    now = datetime.now(timezone.utc)
     project = {
-        "user_id": x_user_id or "guest",
+        "user_id": x_user_id or GUEST,
         "name": req.name or (req.prompt[:40] + "…" if len(req.prompt) > 40 else req.prompt),
         "prompt": req.prompt,
         "html": html,
         "versions": [
-            {"timestamp": datetime.now(timezone.utc), "html": html, "note": "Initial generation"}
+            {"timestamp": now, "html": html, "note": "Initial generation"}
         ],
         "history": [
-            {"timestamp": datetime.now(timezone.utc), "role": "user", "content": req.prompt},
-            {"timestamp": datetime.now(timezone.utc), "role": "assistant", "content": "Generated initial site"},
+            {"timestamp": now, "role": "user", "content": req.prompt},
+            {"timestamp": now, "role": "assistant", "content": "Generated initial site"},
         ],
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "created_at": now,
+        "updated_at": now,
         "status": "draft",
     }
-    pid = create_document("projects", project)
-    return {"project_id": pid, "html": html}
+    pid = await create_document("projects", project)
+    return MongoJSONResponse({"project_id": pid, "html": html})
+
+
+# List view: leave html, versions and history on the server
+PROJECT_LIST_FIELDS = {"name": 1, "prompt": 1, "status": 1, "created_at": 1, "updated_at": 1, "user_id": 1}
 
 
 @app.get("/projects")
-def list_projects(x_user_id: Optional[str] = Header(default=None)):
+async def list_projects(x_user_id: Optional[str] = Header(default=None)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    items = get_documents("projects", {"user_id": x_user_id or "guest"}, limit=50)
+    items = await get_documents(
+        "projects",
+        {"user_id": x_user_id or GUEST},
+        limit=50,
+        projection=PROJECT_LIST_FIELDS,
+        sort=[("updated_at", -1)],
+    )
     for it in items:
-        it["id"] = oid_str(it["_id"]) if "_id" in it else None
-        it.pop("_id", None)
-        it.pop("html", None)  # list view
-    return {"projects": items}
+        it["id"] = it.pop("_id", None)
+    # Returned directly so ObjectIds reach orjson instead of jsonable_encoder
+    return MongoJSONResponse({"projects": items})
+
+
+# Short-lived per-process cache for the editor polling GET /projects/{id}.
+# Keyed on (user_id, project_id) and holding the encoded response body, so
+# the bound is in bytes: project documents carry every HTML version.
+# Writes through this worker invalidate it; with several workers another
+# worker can serve a pre-write copy for up to the TTL.
+PROJECT_CACHE_TTL = 5
+PROJECT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_project_cache = TTLCache(
+    maxsize=PROJECT_CACHE_MAX_BYTES,
+    ttl=PROJECT_CACHE_TTL,
+    getsizeof=lambda entry: len(entry[0]),
+)
+_project_locks = weakref.WeakValueDictionary()
+
+
+def _project_lock(key) -> asyncio.Lock:
+    lock = _project_locks.get(key)
+    if lock is None:
+        lock = _project_locks[key] = asyncio.Lock()
+    return lock
+
+
+async def invalidate_project(user_id: str, project_id: str) -> None:
+    key = (user_id, project_id)
+    # Taking the reader's lock means an in-flight read that fetched the
+    # pre-write document has stored it by now, so this pop removes it
+    async with _project_lock(key):
+        _project_cache.pop(key, None)
+
+
+def _not_modified_since(updated_at: datetime, if_modified_since: str) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have second resolution
+    return updated_at.replace(microsecond=0) <= since
 
 
 @app.get("/projects/{project_id}")
-def get_project(project_id: str, x_user_id: Optional[str] = Header(default=None)):
-    from bson import ObjectId
+async def get_project(
+    project_id: str,
+    x_user_id: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    doc = db.projects.find_one({"_id": ObjectId(project_id), "user_id": x_user_id or "guest"})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Project not found")
-    doc["id"] = oid_str(doc["_id"]) if "_id" in doc else None
-    doc.pop("_id", None)
-    return doc
+    oid = ObjectId(project_id)
+    # ObjectId accepts either hex case; key on the canonical form so writes hit it
+    key = (x_user_id or GUEST, str(oid))
+    entry = _project_cache.get(key)
+    if entry is None:
+        # One Mongo read per key at a time; concurrent pollers wait for it
+        async with _project_lock(key):
+            entry = _project_cache.get(key)
+            if entry is None:
+                doc = await db.projects.find_one({"_id": oid, "user_id": key[0]})
+                if not doc:
+                    raise HTTPException(status_code=404, detail="Project not found")
+                doc["id"] = doc.pop("_id", None)
+                updated_at = doc.get("updated_at")
+                if isinstance(updated_at, datetime) and updated_at.tzinfo is None:
+                    updated_at = updated_at.replace(tzinfo=timezone.utc)
+                entry = (dumps_json(doc), updated_at)
+                if len(entry[0]) <= PROJECT_CACHE_MAX_BYTES:
+                    _project_cache[key] = entry
+
+    body, updated_at = entry
+    headers = {}
+    if isinstance(updated_at, datetime):
+        headers["Last-Modified"] = format_datetime(updated_at, usegmt=True)
+        if if_modified_since and _not_modified_since(updated_at, if_modified_since):
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.put("/projects/{project_id}/code")
-def update_code(project_id: str, req: CodeUpdateRequest, x_user_id: Optional[str] = Header(default=None)):
-    from bson import ObjectId
+async def update_code(project_id: str, req: CodeUpdateRequest, x_user_id: Optional[str] = Header(default=None)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    res = db.projects.update_one(
-        {"_id": ObjectId(project_id), "user_id": x_user_id or "guest"},
+    now = datetime.now(timezone.utc)
+    res = await db.projects.update_one(
+        {"_id": ObjectId(project_id), "user_id": x_user_id or GUEST},
         {
-            "$set": {"html": req.html, "updated_at": datetime.now(timezone.utc)},
-            "$push": {"versions": {"timestamp": datetime.now(timezone.utc), "html": req.html, "note": "Manual edit"}},
+            "$set": {"html": req.html, "updated_at": now},
+            "$push": {"versions": {"timestamp": now, "html": req.html, "note": "Manual edit"}},
         },
     )
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
-    return {"status": "ok"}
+    await invalidate_project(x_user_id or GUEST, str(ObjectId(project_id)))
+    return MongoJSONResponse({"status": "ok"})
 
 
 @app.post("/projects/{project_id}/chat")
-def project_chat(project_id: str, req: ChatMessageRequest, x_user_id: Optional[str] = Header(default=None)):
-    from bson import ObjectId
+async def project_chat(project_id: str, req: ChatMessageRequest, x_user_id: Optional[str] = Header(default=None)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    doc = db.projects.find_one({"_id": ObjectId(project_id), "user_id": x_user_id or "guest"})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    msg = req.message.lower()
-    html = doc.get("html", "")
+    query = {"_id": ObjectId(project_id), "user_id": x_user_id or GUEST}
+    now = datetime.now(timezone.utc)
+    user_entry = {"timestamp": now, "role": "user", "content": req.message}
 
     # Very simple rule-based edits as a placeholder for LLM tool-use
-    note = ""
-    if "sci-fi" in msg or "sci fi" in msg:
-        html = html.replace("#0b0b10", "#05060a").replace("rgba(99,102,241,0.15)", "rgba(56,189,248,0.18)")
-        html = html.replace("Production-ready", "Sci‑fi neon aesthetic with holographic accents")
-        note = "Applied sci-fi theme"
-    elif "make it dark" in msg or "dark mode" in msg:
-        html = html.replace("#0b0b10", "#0a0a0a")
-        note = "Darkened base colors"
-    elif "add pricing" in msg or "pricing" in msg:
-        insertion = """
-<section id=\"pricing\" class=\"max-w-6xl mx-auto px-6 pb-24\">
-  <h2 class=\"text-2xl font-bold mb-6\">Pricing</h2>
-  <div class=\"grid md:grid-cols-3 gap-6\">
-    <div class=\"glass rounded-2xl p-6\"><h3 class=\"font-semibold\">Starter</h3><p class=\"text-4xl font-extrabold mt-2\">$0</p><p class=\"text-white/70 mt-2\">For experiments</p></div>
-    <div class=\"glass rounded-2xl p-6 border border-white/20\"><h3 class=\"font-semibold\">Pro</h3><p class=\"text-4xl font-extrabold mt-2\">$19</p><p class=\"text-white/70 mt-2\">For builders</p></div>
-    <div class=\"glass rounded-2xl p-6\"><h3 class=\"font-semibold\">Scale</h3><p class=\"text-4xl font-extrabold mt-2\">$99</p><p class=\"text-white/70 mt-2\">For teams</p></div>
-  </div>
-</section>
-"""
-        html = html.replace("</main>", insertion + "\n    </main>")
-        note = "Added pricing section"
-    elif "change accent" in msg or "make it crimson" in msg or "crimson" in msg:
-        html = html.replace("--accent: #DC143C", "--accent: #b80f2a")
-        note = "Adjusted accent color"
+    intent = match_chat_intent(req.message.lower())
+    if intent in CHAT_EDITS:
+        # Applied server-side in one round trip; no read of the old html
+        note = CHAT_EDIT_NOTES[intent]
+        assistant_entry = {"timestamp": now, "role": "assistant", "content": note}
+        doc = await db.projects.find_one_and_update(
+            query,
+            chat_edit_pipeline(CHAT_EDITS[intent], now, [user_entry, assistant_entry], note),
+            projection={"html": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not doc:
+            raise HTTPException(status_code=404, detail="Project not found")
+        html = doc.get("html", "")
     else:
+        doc = await db.projects.find_one(query, {"prompt": 1})
+        if not doc:
+            raise HTTPException(status_code=404, detail="Project not found")
         # Regenerate using the new instruction appended to original prompt
         combined = f"{doc.get('prompt','')} — {req.message}"
         html = generate_site_html(combined)
         note = "Regenerated site with new instruction"
-
-    db.projects.update_one(
-        {"_id": ObjectId(project_id)},
-        {
-            "$set": {"html": html, "updated_at": datetime.now(timezone.utc)},
-            "$push": {
-                "history": {"timestamp": datetime.now(timezone.utc), "role": "user", "content": req.message},
-                "history": {"timestamp": datetime.now(timezone.utc), "role": "assistant", "content": note},
-                "versions": {"timestamp": datetime.now(timezone.utc), "html": html, "note": note},
+        assistant_entry = {"timestamp": now, "role": "assistant", "content": note}
+        version_entry = {"timestamp": now, "html": html, "note": note}
+        await db.projects.update_one(
+            {"_id": ObjectId(project_id)},
+            {
+                "$set": {"html": html, "updated_at": now},
+                "$push": {
+                    "history": {"$each": [user_entry, assistant_entry]},
+                    "versions": version_entry,
+                },
             },
-        },
-    )
+        )
+    await invalidate_project(x_user_id or GUEST, str(ObjectId(project_id)))
 
-    return {"status": "ok", "note": note, "html": html}
+    return MongoJSONResponse({"status": "ok", "note": note, "html": html})
 
 
 @app.post("/projects/{project_id}/deploy", response_model=DeployResponse)
 def deploy_project(project_id: str, x_user_id: Optional[str] = Header(default=None)):
     # Simulate deployment. A real implementation would build and upload to a CDN provider
     fake_url = f"https://deploy.crimson.site/{project_id}"
-    return DeployResponse(url=fake_url, status="deployed")
+    # response_model only documents the shape; the trusted dict goes straight to orjson
+    return MongoJSONResponse({"url": fake_url, "status": "deployed"})
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2))
+    # Import-string form so each worker process can import the app itself
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        # uvloop when installed (not on Windows), asyncio otherwise
+        loop="auto",
+        http="httptools",
+        workers=workers,
+        log_level="warning",
+    )